@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import requests
+
+from utils import build_path, if_file_exists, write_file_atomic, file_sha256
+
+
+LOGGER = logging.getLogger()
+MANIFEST = "assets.json"
+
+
+class Asset(object):
+    def __init__(self, filename, url, transform=None):
+        self.filename = filename
+        self.url = url
+        self.transform = transform
+
+    def content(self, raw):
+        if self.transform is not None:
+            return self.transform(raw)
+        return raw
+
+
+class AssetError(Exception):
+    pass
+
+
+class AssetCache(object):
+    """
+    Keeps the static css/js assets in assets_dir. Every asset is pinned
+    by the sha256 of the stored file in a manifest along with its ETag,
+    so warm runs only send conditional requests (or none at all when
+    offline) and a corrupted local copy is fetched again.
+    """
+    def __init__(self, assets_dir, assets):
+        self.assets_dir = build_path([assets_dir])
+        self.assets = assets
+        self.manifest_path = os.path.join(self.assets_dir, MANIFEST)
+        self.manifest = self.load_manifest()
+        self.lock = threading.Lock()
+
+    def load_manifest(self):
+        if if_file_exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {}
+
+    def save_manifest(self):
+        content = json.dumps(self.manifest, indent=2, sort_keys=True)
+        write_file_atomic(self.manifest_path, content, mode="w")
+
+    def path(self, asset):
+        return os.path.join(self.assets_dir, asset.filename)
+
+    def is_valid(self, asset):
+        entry = self.manifest.get(asset.filename)
+        filepath = self.path(asset)
+        return entry is not None and entry.get("url") == asset.url and\
+            if_file_exists(filepath) and file_sha256(filepath) == entry["sha256"]
+
+    def pin_local(self, asset):
+        """
+        Pin a local copy that has no manifest entry yet (checkouts older
+        than the manifest) with its current sha256.
+        """
+        filepath = self.path(asset)
+        if asset.filename in self.manifest or not if_file_exists(filepath):
+            return False
+        with self.lock:
+            self.manifest[asset.filename] = dict(url=asset.url, etag=None,
+                sha256=file_sha256(filepath))
+        LOGGER.info("Pinned local {}".format(asset.filename))
+        return True
+
+    def fetch(self, session, offline=False, workers=4):
+        """Returns the local paths of the assets, fetched concurrently."""
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            paths = list(executor.map(
+                lambda asset: self.fetch_asset(asset, session, offline=offline),
+                self.assets))
+        self.save_manifest()
+        return paths
+
+    def fetch_asset(self, asset, session, offline=False):
+        valid = self.is_valid(asset)
+        if offline:
+            if not valid and not self.pin_local(asset):
+                raise AssetError("{} is not available offline".format(asset.filename))
+            return self.path(asset)
+
+        headers = {}
+        if valid and self.manifest[asset.filename].get("etag"):
+            headers["If-None-Match"] = self.manifest[asset.filename]["etag"]
+        try:
+            response = session.get(asset.url, headers=headers, timeout=30)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            if valid:
+                LOGGER.info("Using local {}: {}".format(asset.filename, e))
+                return self.path(asset)
+            raise AssetError("{} could not be downloaded: {}".format(asset.filename, e))
+
+        if response.status_code == 304:
+            return self.path(asset)
+
+        content = asset.content(response.content)
+        write_file_atomic(self.path(asset), content)
+        with self.lock:
+            self.manifest[asset.filename] = dict(
+                url=asset.url,
+                etag=response.headers.get("ETag"),
+                sha256=hashlib.sha256(content).hexdigest())
+        LOGGER.info("Downloaded {}".format(asset.filename))
+        return self.path(asset)
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from utils import build_path, if_file_exists, write_file_atomic
+
+
+LOGGER = logging.getLogger()
+DAY = 24 * 60 * 60
+
+# errors that mention availability but are not about the video itself
+TRANSIENT_FRAGMENTS = ["requested format not available", "timed out", "unable to download",
+    "http error 429", "http error 5"]
+# (failure class, message fragments, ttl) in the order they are tried
+FAILURE_CLASSES = [
+    ("private", ["private video", "video is private"], 7 * DAY),
+    ("removed", ["has been removed", "account associated with this video has been terminated",
+        "no longer available"], 30 * DAY),
+    ("copyright", ["copyright"], 30 * DAY),
+    ("geo", ["not available in your country", "geo restricted"], 7 * DAY),
+    ("unavailable", ["video unavailable", "video is unavailable", "not available"], 3 * DAY),
+]
+
+
+def classify_failure(error):
+    """Returns (failure class, ttl) for a permanent youtube_dl error or None."""
+    message = str(error).lower()
+    if any(fragment in message for fragment in TRANSIENT_FRAGMENTS):
+        return None
+    for failure, fragments, ttl in FAILURE_CLASSES:
+        if any(fragment in message for fragment in fragments):
+            return failure, ttl
+    return None
+
+
+class NegativeCache(object):
+    """
+    Persistent record of the videos that failed with a permanent error
+    (private, removed, ...) keyed by video id, every entry expires after
+    the ttl of its failure class.
+    """
+    def __init__(self, filepath, clock=time.time):
+        self.filepath = filepath
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = None
+        self.skipped = []
+        self.added = []
+
+    def load(self):
+        if self.entries is None:
+            self.entries = {}
+            if if_file_exists(self.filepath):
+                with open(self.filepath) as f:
+                    self.entries = json.load(f)
+        return self.entries
+
+    def get(self, video_id):
+        if video_id is None:
+            return None
+        with self.lock:
+            entry = self.load().get(video_id)
+            if entry is None or entry["expires"] < self.clock():
+                return None
+            if video_id not in self.skipped:
+                self.skipped.append(video_id)
+            return entry
+
+    def add(self, video_id, error):
+        failure = classify_failure(error)
+        if video_id is None or failure is None:
+            return None
+        failure, ttl = failure
+        now = self.clock()
+        entry = dict(failure=failure, message=str(error), checked=now, expires=now + ttl)
+        with self.lock:
+            self.load()[video_id] = entry
+            self.added.append(video_id)
+        return entry
+
+    def remove(self, video_id):
+        with self.lock:
+            self.load().pop(video_id, None)
+
+    def save(self):
+        with self.lock:
+            now = self.clock()
+            entries = dict((video_id, entry) for video_id, entry in self.load().items()
+                if entry["expires"] >= now)
+            content = json.dumps(entries, indent=2, sort_keys=True)
+        build_path([os.path.dirname(os.path.abspath(self.filepath))])
+        write_file_atomic(self.filepath, content, mode="w")
+
+    def report(self):
+        entries = self.load()
+        if len(self.skipped) + len(self.added) == 0:
+            return
+        LOGGER.info("Unavailable videos: {} skipped, {} new".format(
+            len(self.skipped), len(self.added)))
+        for video_id in self.skipped + self.added:
+            entry = entries.get(video_id)
+            if entry is not None:
+                LOGGER.info("  - {} [{}] {}".format(video_id, entry["failure"],
+                    entry["message"]))
+        self.skipped = []
+        self.added = []
+
+
+class PageModelCache(object):
+    """
+    Keeps the sections extracted from a page as compact json, one file per
+    url, along with the hash of the document they were extracted from. The
+    last model of each url is also kept in memory for resident processes.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.memory = {}
+
+    def path(self, url):
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "{}.json".format(name))
+
+    def get(self, url, key):
+        model = self.memory.get(url)
+        if model is None:
+            filepath = self.path(url)
+            if not if_file_exists(filepath):
+                return None
+            with open(filepath, encoding="utf-8") as f:
+                model = json.load(f)
+            self.memory[url] = model
+        if model.get("url") != url or model.get("key") != key:
+            return None
+        return model["sections"]
+
+    def set(self, url, key, sections):
+        build_path([self.cache_dir])
+        model = dict(url=url, key=key, sections=sections)
+        self.memory[url] = model
+        content = json.dumps(model, ensure_ascii=False, separators=(",", ":"))
+        write_file_atomic(self.path(url), content.encode("utf-8"))
@@ -0,0 +1,162 @@
+"""
+Checks the mp4 box walker, verify_mp4 and the faststart rewrite on small
+synthetic files: every chunk offset must read the same bytes before and
+after moov is moved, for mdat boxes before and after the old moov, with
+stco and co64 tables. Broken tables must be refused without touching the
+file.
+
+    python check_mp4.py
+"""
+import os
+import shutil
+import struct
+import tempfile
+
+from mp4 import (CONTAINER_BOXES, FaststartPool, MP4Error, faststart, is_faststart,
+    iter_boxes, verify_mp4)
+
+
+FTYP = struct.pack(">I4s", 16, b"ftyp") + b"isom\0\0\0\0"
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, payload):
+    return box(box_type, b"\0\0\0\0" + payload)
+
+
+def moov_box(offsets, co64=False, count=None):
+    entry_format = ">Q" if co64 else ">I"
+    table = full_box(b"co64" if co64 else b"stco",
+        struct.pack(">I", len(offsets) if count is None else count) +
+        b"".join(struct.pack(entry_format, offset) for offset in offsets))
+    stbl = box(b"stbl", table)
+    return box(b"moov", full_box(b"mvhd", b"\0" * 96) +
+        box(b"trak", box(b"mdia", box(b"minf", stbl))))
+
+
+def build(layout, co64=False, count=None):
+    """
+    layout is a list of b"moov", b"free" or chunk payloads (one mdat each),
+    returns the file bytes and the chunk payloads in order.
+    """
+    chunks = [part for part in layout if part not in (b"moov", b"free")]
+    moov_size = len(moov_box([0] * len(chunks), co64=co64))
+    offsets = []
+    position = len(FTYP)
+    for part in layout:
+        if part == b"moov":
+            position += moov_size
+        elif part == b"free":
+            position += 8
+        else:
+            offsets.append(position + 8)
+            position += 8 + len(part)
+    data = FTYP
+    for part in layout:
+        if part == b"moov":
+            data += moov_box(offsets, co64=co64, count=count)
+        elif part == b"free":
+            data += box(b"free", b"")
+        else:
+            data += box(b"mdat", part)
+    return data, chunks
+
+
+def chunk_offsets(buf, start, end):
+    for box_type, offset, size, header_size in iter_boxes(buf, start, end):
+        if box_type in CONTAINER_BOXES:
+            for chunk_offset in chunk_offsets(buf, offset + header_size, offset + size):
+                yield chunk_offset
+        elif box_type in (b"stco", b"co64"):
+            count = struct.unpack_from(">I", buf, offset + header_size + 4)[0]
+            entry_format = ">{}{}".format(count, "I" if box_type == b"stco" else "Q")
+            for chunk_offset in struct.unpack_from(entry_format, buf, offset + header_size + 8):
+                yield chunk_offset
+
+
+def read(filepath):
+    with open(filepath, "rb") as f:
+        return f.read()
+
+
+def write(directory, name, data):
+    filepath = os.path.join(directory, name)
+    with open(filepath, "wb") as f:
+        f.write(data)
+    return filepath
+
+
+def check_verify(directory):
+    data, _ = build([b"chunk one", b"moov"])
+    assert verify_mp4(write(directory, "good.mp4", data)) is None, "good file refused"
+    assert verify_mp4(write(directory, "truncated.mp4", data[:-5])) is not None,\
+        "truncated file accepted"
+    no_moov = FTYP + box(b"mdat", b"chunk one")
+    assert "moov" in verify_mp4(write(directory, "no-moov.mp4", no_moov)), "missing moov accepted"
+    assert verify_mp4(write(directory, "empty.mp4", b"")) == "empty file", "empty file accepted"
+    bad_size = FTYP + struct.pack(">I4s", 4, b"mdat")
+    assert verify_mp4(write(directory, "bad-size.mp4", bad_size)) is not None,\
+        "box smaller than its header accepted"
+
+
+def check_faststart(directory):
+    layouts = [
+        ("mdat before moov", [b"chunk one", b"chunk two", b"moov"], False),
+        ("mdat on both sides of moov", [b"chunk one", b"moov", b"chunk two"], False),
+        ("co64 and free boxes", [b"free", b"chunk one", b"moov", b"free", b"chunk two"], True),
+    ]
+    for name, layout, co64 in layouts:
+        data, chunks = build(layout, co64=co64)
+        filepath = write(directory, "faststart.mp4", data)
+        before = [data[offset:offset + len(chunk)]
+            for offset, chunk in zip(chunk_offsets(data, 0, len(data)), chunks)]
+        assert before == chunks, "{}: bad synthetic file".format(name)
+        assert not is_faststart(filepath), "{}: already faststart".format(name)
+
+        assert faststart(filepath, block_size=4), "{}: not rewritten".format(name)
+        out = read(filepath)
+        after = [out[offset:offset + len(chunk)]
+            for offset, chunk in zip(chunk_offsets(out, 0, len(out)), chunks)]
+        assert after == chunks, "{}: chunks moved: {}".format(name, after)
+        assert is_faststart(filepath), "{}: moov not in front".format(name)
+        assert verify_mp4(filepath) is None, "{}: broken output".format(name)
+        assert len(out) == len(data), "{}: size changed".format(name)
+        assert not faststart(filepath), "{}: rewritten twice".format(name)
+
+
+def check_broken_tables(directory):
+    data, _ = build([b"chunk one", b"moov"], count=1000)
+    filepath = write(directory, "bad-count.mp4", data)
+    assert verify_mp4(filepath) is None, "the headers alone should look fine"
+    pool = FaststartPool(os.path.join(directory, "faststart.json"))
+    pool.submit(filepath)
+    pool.close()
+    assert read(filepath) == data, "file changed by a failed remux"
+    assert not os.path.exists(filepath + ".faststart"), "temp file left behind"
+
+    mdat = box(b"mdat", b"chunk one")
+    data = FTYP + mdat + moov_box([len(FTYP) + len(mdat) + 8])
+    filepath = write(directory, "into-moov.mp4", data)
+    try:
+        faststart(filepath)
+        raise AssertionError("chunk offset into moov accepted")
+    except MP4Error:
+        pass
+    assert read(filepath) == data, "file changed by a failed remux"
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        for check in (check_verify, check_faststart, check_broken_tables):
+            check(directory)
+            print("{}: ok".format(check.__name__))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
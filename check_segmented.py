@@ -0,0 +1,138 @@
+"""
+Checks the segmented downloader against a local Range capable http.server:
+a plain segmented download, the resume of an interrupted download from
+its .segments state and the fallback to one stream when the server
+ignores Range requests.
+
+    python check_segmented.py
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import requests
+import youtube_dl
+
+from segmented import RangeNotSupported, SegmentedDownload, SegmentedFD
+
+
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d*)")
+CONTENT = os.urandom(6 * 1024 * 1024 + 123)
+
+
+class Interrupted(Exception):
+    pass
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves CONTENT on /video.mp4, /no-range.mp4 ignores Range requests."""
+    protocol_version = "HTTP/1.1"
+    sent = 0
+    lock = threading.Lock()
+
+    def handle(self):
+        # the interrupted downloads drop their connections
+        try:
+            BaseHTTPRequestHandler.handle(self)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if self.path == "/no-range.mp4" or match is None:
+            start, end = 0, len(CONTENT) - 1
+            self.send_response(200)
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or len(CONTENT) - 1), len(CONTENT) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, len(CONTENT)))
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        for offset in range(start, end + 1, 64 * 1024):
+            chunk = CONTENT[offset:min(offset + 64 * 1024, end + 1)]
+            self.wfile.write(chunk)
+            with RangeHandler.lock:
+                RangeHandler.sent += len(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def read(filepath):
+    with open(filepath, "rb") as f:
+        return f.read()
+
+
+def check_download(base_url, directory):
+    filepath = os.path.join(directory, "plain.mp4")
+    SegmentedDownload(requests.Session(), base_url + "/video.mp4", filepath,
+        segments=4, min_segment_size=1024 * 1024).run()
+    assert read(filepath) == CONTENT, "segmented download differs from the source"
+    assert not os.path.exists(filepath + ".segments"), "state file left behind"
+
+
+def check_resume(base_url, directory):
+    filepath = os.path.join(directory, "resumed.mp4")
+
+    def interrupt(downloaded, total):
+        if downloaded > total // 2:
+            raise Interrupted()
+
+    download = SegmentedDownload(requests.Session(), base_url + "/video.mp4", filepath,
+        segments=4, min_segment_size=1024 * 1024, progress=interrupt)
+    try:
+        download.run()
+        raise AssertionError("the download was not interrupted")
+    except Interrupted:
+        pass
+    assert os.path.exists(filepath + ".segments"), "no state to resume from"
+    assert os.path.exists(filepath + ".segpart"), "no partial file to resume from"
+
+    RangeHandler.sent = 0
+    SegmentedDownload(requests.Session(), base_url + "/video.mp4", filepath,
+        segments=4, min_segment_size=1024 * 1024).run()
+    assert read(filepath) == CONTENT, "resumed download differs from the source"
+    assert RangeHandler.sent < len(CONTENT), "resume downloaded the whole file again"
+    print("  resume fetched {} of {} bytes".format(RangeHandler.sent, len(CONTENT)))
+
+
+def check_fallback(base_url, directory):
+    filepath = os.path.join(directory, "fallback.mp4")
+    session = requests.Session()
+    try:
+        SegmentedDownload(session, base_url + "/no-range.mp4", filepath).run()
+        raise AssertionError("RangeNotSupported was not raised")
+    except RangeNotSupported:
+        pass
+
+    ydl = youtube_dl.YoutubeDL({"quiet": True, "noprogress": True})
+    downloader = SegmentedFD(ydl, dict(ydl.params, segments_session=session, segments=4))
+    info = dict(url=base_url + "/no-range.mp4", protocol="http", http_headers={})
+    assert downloader.real_download(filepath, info), "fallback download failed"
+    assert read(filepath) == CONTENT, "fallback download differs from the source"
+    assert not os.path.exists(filepath + ".segpart"), "segmented files left behind"
+    assert not os.path.exists(filepath + ".segments"), "segmented files left behind"
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    directory = tempfile.mkdtemp()
+    try:
+        for check in (check_download, check_resume, check_fallback):
+            check(base_url, directory)
+            print("{}: ok".format(check.__name__))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
+
+
+LOG_CONTEXT = contextvars.ContextVar("log_context", default={})
+CONSOLE_FORMAT = "%(context)s%(message)s"
+
+_handler = None
+_listener = None
+# (handler, level) of the handlers found on the logger by setup_logging
+_previous = []
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach fields (section, video_id) to every record logged inside the
+    block by the current thread.
+    """
+    context = dict(LOG_CONTEXT.get())
+    context.update(fields)
+    token = LOG_CONTEXT.set(context)
+    try:
+        yield
+    finally:
+        LOG_CONTEXT.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    # Runs on the QueueHandler, in the thread that logged the record
+    def filter(self, record):
+        context = LOG_CONTEXT.get()
+        record.section = context.get("section")
+        record.video_id = context.get("video_id")
+        record.context = "[{}] ".format(record.video_id) if record.video_id else ""
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        fields = dict(
+            time=record.created,
+            level=record.levelname,
+            thread=record.threadName,
+            section=getattr(record, "section", None),
+            video_id=getattr(record, "video_id", None),
+            message=record.getMessage())
+        if record.exc_info:
+            fields["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(fields, ensure_ascii=False)
+
+
+def is_console(handler):
+    # FileHandler is a StreamHandler too
+    return isinstance(handler, logging.StreamHandler) and\
+        not isinstance(handler, logging.FileHandler)
+
+
+def setup_logging(logger, level=logging.INFO, log_file=None, quiet=False):
+    """
+    Route logger through a QueueHandler so worker threads only pay for a
+    queue put. The handlers already on the logger (ricecooker's console and
+    log files) are moved behind a single QueueListener thread along with
+    the optional JSON lines log_file, the console only shows WARNING and up
+    if quiet. stop_logging puts the previous handlers back.
+    """
+    global _handler, _listener, _previous
+    stop_logging(logger)
+    _previous = [(handler, handler.level) for handler in logger.handlers]
+    handlers = []
+    for handler, handler_level in _previous:
+        logger.removeHandler(handler)
+        if quiet and is_console(handler):
+            handler.setLevel(max(handler_level, logging.WARNING))
+        handlers.append(handler)
+    if not any(is_console(handler) for handler in handlers):
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+        console.setLevel(logging.WARNING if quiet else level)
+        handlers.append(console)
+    if log_file is not None:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        file_handler.setLevel(level)
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    _handler = QueueHandler(log_queue)
+    _handler.addFilter(ContextFilter())
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    logger.addHandler(_handler)
+    logger.setLevel(level)
+    return _listener
+
+
+def stop_logging(logger):
+    """
+    Flush the queued records, close the handlers added by setup_logging and
+    give the logger its previous handlers back.
+    """
+    global _handler, _listener, _previous
+    if _listener is not None:
+        _listener.stop()
+        previous = [handler for handler, _ in _previous]
+        for handler in _listener.handlers:
+            if handler not in previous:
+                handler.close()
+        _listener = None
+    if _handler is not None:
+        logger.removeHandler(_handler)
+        _handler = None
+    for handler, handler_level in _previous:
+        handler.setLevel(handler_level)
+        logger.addHandler(handler)
+    _previous = []
@@ -0,0 +1,124 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import signal
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+
+class ChefDaemon(object):
+    """
+    Keeps the chef resident and runs cycle() every `interval` seconds or
+    when triggered with a POST /scrape on the local control port. GET
+    /status returns the state of the last cycles as json. Everything the
+    chef keeps in memory between cycles (page model, video metadata,
+    youtube_dl instances, http pools) stays warm.
+    """
+    def __init__(self, cycle, interval=6 * 60 * 60, port=8765, host="127.0.0.1"):
+        self.cycle = cycle
+        self.interval = interval
+        self.port = port
+        self.host = host
+        self.trigger = threading.Event()
+        self.stopping = threading.Event()
+        self.server = None
+        self.status = dict(state="idle", cycles=0, last_start=None, last_end=None,
+            last_duration=None, last_error=None, next_run=None)
+
+    def run_cycle(self):
+        self.status.update(state="scraping", last_start=time.time())
+        LOGGER.info("Daemon: starting cycle {}".format(self.status["cycles"] + 1))
+        try:
+            self.cycle()
+            self.status["last_error"] = None
+        except Exception as e:
+            LOGGER.exception("Daemon: cycle failed")
+            self.status["last_error"] = str(e)
+        now = time.time()
+        self.status.update(state="idle", cycles=self.status["cycles"] + 1, last_end=now,
+            last_duration=now - self.status["last_start"], next_run=now + self.interval)
+        LOGGER.info("Daemon: cycle done in {:.1f}s".format(self.status["last_duration"]))
+
+    def serve(self):
+        self.start_server()
+        previous_handlers = self.install_signals()
+        try:
+            while not self.stopping.is_set():
+                self.run_cycle()
+                self.trigger.wait(self.interval)
+                self.trigger.clear()
+        finally:
+            self.stop_server()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def stop(self, *args):
+        self.stopping.set()
+        self.trigger.set()
+
+    def on_signal(self, signum, frame):
+        """
+        Between cycles the daemon just stops, a running cycle is
+        interrupted right away like without the daemon.
+        """
+        self.stop()
+        if self.status["state"] == "scraping":
+            if signum == signal.SIGINT:
+                raise KeyboardInterrupt()
+            raise SystemExit(128 + signum)
+
+    def install_signals(self):
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, self.on_signal)
+        return handlers
+
+    def start_server(self):
+        if not self.port:
+            return
+        self.server = ThreadingHTTPServer((self.host, self.port), control_handler(self))
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        LOGGER.info("Daemon: control endpoint on http://{}:{}/".format(self.host, self.port))
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def control_handler(daemon):
+    class ControlHandler(BaseHTTPRequestHandler):
+        def reply(self, code, content):
+            body = json.dumps(content).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/status":
+                self.reply(200, daemon.status)
+            else:
+                self.reply(404, dict(error="not found"))
+
+        def do_POST(self):
+            if self.path == "/scrape":
+                daemon.trigger.set()
+                self.reply(202, dict(queued=True, state=daemon.status["state"]))
+            elif self.path == "/stop":
+                daemon.stop()
+                self.reply(202, dict(stopping=True))
+            else:
+                self.reply(404, dict(error="not found"))
+
+        def log_message(self, format, *args):
+            LOGGER.debug("Daemon: " + format % args)
+
+    return ControlHandler
@@ -0,0 +1,293 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import subprocess
+import threading
+
+from utils import if_file_exists, file_sha256, write_file_atomic
+
+
+LOGGER = logging.getLogger()
+REQUIRED_BOXES = (b"ftyp", b"moov", b"mdat")
+# final <video id>.mp4 names, youtube_dl's .temp.mp4 and .fNNN.mp4 files and
+# the .faststart.mp4 remuxes may be in progress in another run
+VIDEO_NAME_RE = re.compile(r"^[0-9A-Za-z_-]{11}\.mp4$")
+
+
+class MP4Error(Exception):
+    pass
+
+
+def iter_boxes(buf, start, end):
+    """
+    Yields (type, offset, size, header_size) for the boxes in buf[start:end],
+    only the box headers are read.
+    """
+    offset = start
+    while offset < end:
+        if end - offset < 8:
+            raise MP4Error("truncated box header at {}".format(offset))
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header_size = 8
+        if size == 1:
+            if end - offset < 16:
+                raise MP4Error("truncated largesize header at {}".format(offset))
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise MP4Error("invalid size {} for {} at {}".format(size, box_type, offset))
+        if offset + size > end:
+            raise MP4Error("{} at {} needs {} bytes, {} left".format(
+                box_type.decode("latin-1"), offset, size, end - offset))
+        yield box_type, offset, size, header_size
+        offset += size
+
+
+def verify_mp4(filepath):
+    """
+    Checks that the top level boxes of filepath cover the file length
+    exactly, that ftyp, moov and mdat are there and that moov has a mvhd
+    and at least one trak. Returns None if the file is fine, else the reason.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            length = os.fstat(f.fileno()).st_size
+            if length == 0:
+                return "empty file"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                boxes = list(iter_boxes(buf, 0, length))
+                types = [box_type for box_type, _, _, _ in boxes]
+                missing = [box_type.decode() for box_type in REQUIRED_BOXES
+                    if box_type not in types]
+                if missing:
+                    return "missing {}".format(", ".join(missing))
+                _, offset, size, header_size = boxes[types.index(b"moov")]
+                children = [box_type for box_type, _, _, _ in
+                    iter_boxes(buf, offset + header_size, offset + size)]
+                if b"mvhd" not in children or b"trak" not in children:
+                    return "moov without mvhd or trak"
+    except MP4Error as e:
+        return str(e)
+    except (OSError, ValueError) as e:
+        return "unreadable: {}".format(e)
+    return None
+
+
+def verify_videos(directory, remove=True, name_re=VIDEO_NAME_RE):
+    """
+    Verify every finished video (the names matching name_re) under
+    directory and remove the broken ones so they are downloaded again.
+    Returns the [(filepath, reason)] of broken files.
+    """
+    broken = []
+    checked = 0
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if not name_re.match(filename):
+                continue
+            filepath = os.path.join(root, filename)
+            checked += 1
+            reason = verify_mp4(filepath)
+            if reason is not None:
+                broken.append((filepath, reason))
+                LOGGER.info("Broken video {}: {}".format(filepath, reason))
+                if remove:
+                    os.remove(filepath)
+    LOGGER.info("Verified {} videos, {} broken".format(checked, len(broken)))
+    return broken
+
+
+# boxes on the path from moov to the stco/co64 chunk offset tables
+CONTAINER_BOXES = set([b"moov", b"trak", b"mdia", b"minf", b"stbl"])
+
+
+def is_faststart(filepath):
+    """True if moov comes before the first mdat, raises MP4Error if broken."""
+    with open(filepath, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        if length == 0:
+            raise MP4Error("empty file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for box_type, _, _, _ in iter_boxes(buf, 0, length):
+                if box_type == b"moov":
+                    return True
+                if box_type == b"mdat":
+                    return False
+    raise MP4Error("no moov or mdat")
+
+
+def shift_chunk_offsets(moov, start, end, moov_offset, moov_size):
+    """
+    Fix the stco/co64 entries found under moov[start:end] for a moov box
+    moved from moov_offset to right after ftyp: the chunks before the old
+    moov move by moov_size, the ones after it stay where they were.
+    """
+    for box_type, offset, size, header_size in iter_boxes(moov, start, end):
+        if box_type in CONTAINER_BOXES:
+            shift_chunk_offsets(moov, offset + header_size, offset + size,
+                moov_offset, moov_size)
+        elif box_type in (b"stco", b"co64"):
+            # full box: version/flags then the entry count
+            entries_at = offset + header_size + 4
+            if entries_at + 4 > offset + size:
+                raise MP4Error("truncated {}".format(box_type.decode()))
+            count = struct.unpack_from(">I", moov, entries_at)[0]
+            entry_format = ">I" if box_type == b"stco" else ">Q"
+            entry_size = struct.calcsize(entry_format)
+            if entries_at + 4 + count * entry_size > offset + size:
+                raise MP4Error("{} has {} entries, more than its size".format(
+                    box_type.decode(), count))
+            for i in range(count):
+                position = entries_at + 4 + i * entry_size
+                value = struct.unpack_from(entry_format, moov, position)[0]
+                if moov_offset <= value < moov_offset + moov_size:
+                    raise MP4Error("chunk offset {} points into moov".format(value))
+                if value < moov_offset:
+                    value += moov_size
+                if box_type == b"stco" and value > 0xFFFFFFFF:
+                    raise MP4Error("chunk offsets don't fit in stco")
+                struct.pack_into(entry_format, moov, position, value)
+
+
+def faststart(filepath, block_size=1 << 20):
+    """
+    Move moov right after ftyp without re-encoding, the stco/co64 chunk
+    offsets before the old moov are shifted by the moov size (see
+    shift_chunk_offsets). The file is replaced through a
+    temp file in the same dir. Returns False if it was already faststart.
+    """
+    with open(filepath, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            boxes = list(iter_boxes(buf, 0, length))
+            types = [box_type for box_type, _, _, _ in boxes]
+            if b"moof" in types:
+                raise MP4Error("fragmented mp4")
+            if b"moov" not in types or b"mdat" not in types:
+                raise MP4Error("no moov or mdat")
+            if types.index(b"moov") < types.index(b"mdat"):
+                return False
+            if types[0] != b"ftyp":
+                raise MP4Error("ftyp is not the first box")
+
+            _, moov_offset, moov_size, moov_header = boxes[types.index(b"moov")]
+            moov = bytearray(buf[moov_offset:moov_offset + moov_size])
+            shift_chunk_offsets(moov, moov_header, moov_size, moov_offset, moov_size)
+
+            tmp_path = filepath + ".faststart"
+            try:
+                with open(tmp_path, "wb") as out:
+                    for i, (box_type, offset, size, _) in enumerate(boxes):
+                        if box_type == b"moov":
+                            continue
+                        for position in range(offset, offset + size, block_size):
+                            out.write(buf[position:min(position + block_size, offset + size)])
+                        if i == 0:
+                            out.write(moov)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    replace_verified(tmp_path, filepath)
+    return True
+
+
+def replace_verified(tmp_path, filepath):
+    reason = verify_mp4(tmp_path)
+    if reason is not None:
+        os.remove(tmp_path)
+        raise MP4Error("remuxed file is broken: {}".format(reason))
+    os.replace(tmp_path, filepath)
+
+
+def faststart_ffmpeg(filepath, ffmpeg="ffmpeg"):
+    """Same as faststart through a local ffmpeg -movflags faststart remux."""
+    if is_faststart(filepath):
+        return False
+    tmp_path = filepath + ".faststart.mp4"
+    command = [ffmpeg, "-v", "error", "-y", "-i", filepath, "-map", "0", "-c", "copy",
+        "-movflags", "+faststart", tmp_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise MP4Error("ffmpeg failed: {}".format(result.stderr.decode("utf-8", "replace").strip()))
+    replace_verified(tmp_path, filepath)
+    return True
+
+
+class FaststartPool(object):
+    """
+    Runs faststart (method "pure") or faststart_ffmpeg (method "ffmpeg") on
+    the downloaded files in a thread pool while the scrape goes on. Files
+    that are already faststart are skipped from their box headers, the
+    outcome of every remux is kept in cache_path by the sha256 of the
+    input, so a file that can't be remuxed is not tried again. A failure
+    never leaves the pool, the file just stays as it was downloaded.
+    """
+    def __init__(self, cache_path, method="pure", workers=2):
+        if method not in ("pure", "ffmpeg"):
+            raise ValueError("unknown faststart method: {}".format(method))
+        self.cache_path = cache_path
+        self.method = method
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.entries = {}
+        if if_file_exists(cache_path):
+            with open(cache_path) as f:
+                self.entries = json.load(f)
+
+    def submit(self, filepath):
+        with self.lock:
+            if filepath not in self.futures:
+                self.futures[filepath] = self.executor.submit(self.process, filepath)
+
+    def process(self, filepath):
+        key = None
+        try:
+            if is_faststart(filepath):
+                return "skipped"
+            key = file_sha256(filepath)
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry is not None and entry["status"] == "failed":
+                return "failed"
+            if self.method == "ffmpeg":
+                faststart_ffmpeg(filepath)
+            else:
+                faststart(filepath)
+            entry = dict(status="done", method=self.method, output=file_sha256(filepath))
+        except Exception as e:
+            LOGGER.info("Faststart {}: {}".format(filepath, e))
+            entry = dict(status="failed", method=self.method, reason=str(e))
+            # an io error may not happen again, only the file itself is cached
+            if isinstance(e, OSError):
+                key = None
+        if key is not None:
+            with self.lock:
+                self.entries[key] = entry
+        return entry["status"]
+
+    def close(self):
+        """Waits for the pending files, saves the cache and logs the outcome."""
+        self.executor.shutdown(wait=True)
+        counts = {}
+        for future in self.futures.values():
+            status = "failed" if future.exception() is not None else future.result()
+            counts[status] = counts.get(status, 0) + 1
+        with self.lock:
+            content = json.dumps(self.entries, indent=2, sort_keys=True)
+        try:
+            write_file_atomic(self.cache_path, content, mode="w")
+        except OSError as e:
+            LOGGER.info("Faststart cache not saved: {}".format(e))
+        if len(counts) > 0:
+            LOGGER.info("Faststart: {}".format(", ".join(
+                "{} {}".format(count, status) for status, count in sorted(counts.items()))))
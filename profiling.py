@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+import tracemalloc
+
+from utils import build_path
+
+
+LOGGER = logging.getLogger()
+TOP_ALLOCATIONS = 25
+
+# tracemalloc is process wide, it is started by the first open stage of
+# any profiler and stopped when the last one closes
+_tracing_lock = threading.Lock()
+_tracing_stages = 0
+_tracing_owned = False
+
+
+def start_tracing(frames):
+    global _tracing_stages, _tracing_owned
+    with _tracing_lock:
+        if _tracing_stages == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _tracing_owned = True
+        _tracing_stages += 1
+
+
+def stop_tracing():
+    global _tracing_stages, _tracing_owned
+    with _tracing_lock:
+        _tracing_stages -= 1
+        if _tracing_stages == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+class ScrapeProfiler(object):
+    """
+    Profiles each stage of a scrape with cProfile and tracemalloc and saves
+    a <n>-<stage>.prof dump plus a <n>-<stage>.txt with the top allocation
+    sites under profiles_dir/<run id>/. Only a sample_rate fraction of the
+    runs is profiled, a run that is not sampled costs nothing beyond the
+    random draw.
+    """
+    def __init__(self, profiles_dir, sample_rate=1., frames=1):
+        self.enabled = sample_rate > 0 and random.random() < sample_rate
+        self.frames = frames
+        self.stages = 0
+        self.run_dir = None
+        if self.enabled:
+            self.run_dir = build_path([profiles_dir, time.strftime("%Y%m%d-%H%M%S")])
+            LOGGER.info("Profiling the scrape into {}".format(self.run_dir))
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        start_tracing(self.frames)
+        self.stages += 1
+        basename = os.path.join(self.run_dir, "{:02d}-{}".format(self.stages,
+            re.sub(r"[^\w-]+", "_", name).strip("_")))
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            stop_tracing()
+            profile.dump_stats(basename + ".prof")
+            self.write_allocations(basename + ".txt", name, before, after, current, peak)
+
+    def write_allocations(self, filepath, name, before, after, current, peak):
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(filters).compare_to(
+            before.filter_traces(filters), "lineno")
+        with open(filepath, "w") as f:
+            f.write("{}\n".format(name))
+            f.write("traced memory: {} KiB, peak: {} KiB\n\n".format(
+                current // 1024, peak // 1024))
+            for stat in stats[:TOP_ALLOCATIONS]:
+                f.write("{}\n".format(stat))
@@ -0,0 +1,200 @@
+from collections import deque, OrderedDict
+import json
+import logging
+import threading
+import time
+
+
+LOGGER = logging.getLogger()
+
+
+class ProgressReporter(object):
+    """
+    Run-wide aggregator fed by youtube_dl progress hooks. It logs the
+    aggregate bandwidth, videos done/total per section and an ETA at most
+    once every `interval` seconds and, if events_path is given, appends
+    every event as a JSON line for dashboards.
+    """
+    def __init__(self, interval=5, window=10, events_path=None, clock=time.time):
+        self.interval = interval
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sections = OrderedDict()
+        self.files_bytes = {}
+        self.samples = deque()
+        self.total_bytes = 0
+        self.started = clock()
+        self.last_report = 0
+        self.incidents = []
+        self.events = open(events_path, "a") if events_path is not None else None
+
+    def add_section(self, title, total):
+        with self.lock:
+            self.sections[title] = dict(total=total, done=0)
+        self.emit("section", section=title, total=total)
+
+    def hook(self, section_title, video_id):
+        def progress_hook(status):
+            self.update(section_title, video_id, status)
+        return progress_hook
+
+    def update(self, section_title, video_id, status):
+        filename = status.get("filename")
+        downloaded = status.get("downloaded_bytes") or 0
+        with self.lock:
+            now = self.clock()
+            delta = max(downloaded - self.files_bytes.get(filename, 0), 0)
+            self.files_bytes[filename] = downloaded
+            self.total_bytes += delta
+            self.samples.append((now, delta))
+            while self.samples and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+        if status.get("status") != "downloading":
+            self.emit(status.get("status"), section=section_title, video_id=video_id,
+                filename=filename, bytes=downloaded)
+        self.maybe_report()
+
+    def video_done(self, section_title, video_id):
+        with self.lock:
+            if section_title in self.sections:
+                self.sections[section_title]["done"] += 1
+        self.emit("video_done", section=section_title, video_id=video_id)
+        self.maybe_report()
+
+    def incident(self, kind, section_title, video_id, detail=""):
+        """Record a stall, deadline or restart for the end of run summary."""
+        with self.lock:
+            self.incidents.append((kind, section_title, video_id, detail))
+        LOGGER.info("    + {}: {}".format(kind, detail))
+        self.emit(kind, section=section_title, video_id=video_id, detail=detail)
+
+    def bandwidth(self):
+        with self.lock:
+            if len(self.samples) == 0:
+                return 0.
+            span = max(self.clock() - self.samples[0][0], 1.)
+            return sum(delta for _, delta in self.samples) / span
+
+    def eta(self):
+        with self.lock:
+            done = sum(section["done"] for section in self.sections.values())
+            total = sum(section["total"] for section in self.sections.values())
+        if done == 0:
+            return None
+        elapsed = self.clock() - self.started
+        return elapsed / done * (total - done)
+
+    def maybe_report(self):
+        now = self.clock()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self):
+        bandwidth = self.bandwidth()
+        eta = self.eta()
+        with self.lock:
+            sections = [(title, section["done"], section["total"])
+                for title, section in self.sections.items()]
+        eta_text = "--:--:--" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+        LOGGER.info("  >> {}/s, ETA {}, {}".format(format_bytes(bandwidth), eta_text,
+            ", ".join("{}: {}/{}".format(title, done, total) for title, done, total in sections)))
+        self.emit("report", bandwidth=bandwidth, eta=eta,
+            sections=[dict(section=title, done=done, total=total)
+                for title, done, total in sections])
+
+    def emit(self, event, **fields):
+        if self.events is None:
+            return
+        fields["event"] = event
+        fields["time"] = self.clock()
+        line = json.dumps(fields, ensure_ascii=False)
+        with self.lock:
+            self.events.write(line + "\n")
+            self.events.flush()
+
+    def summary(self):
+        if len(self.incidents) == 0:
+            return
+        counts = OrderedDict()
+        for kind, _, _, _ in self.incidents:
+            counts[kind] = counts.get(kind, 0) + 1
+        LOGGER.info("Incidents: {}".format(", ".join(
+            "{} {}".format(count, kind) for kind, count in counts.items())))
+        for kind, section_title, video_id, detail in self.incidents:
+            LOGGER.info("  - {} {} [{}] {}".format(kind, video_id, section_title, detail))
+
+    def close(self):
+        self.report()
+        self.summary()
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+
+
+def format_bytes(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num < 1024.:
+            return "{:.1f} {}".format(num, unit)
+        num /= 1024.
+    return "{:.1f} TB".format(num)
+
+
+class StallError(Exception):
+    kind = "stall"
+
+
+class DeadlineExceeded(StallError):
+    kind = "deadline"
+
+
+class StallWatchdog(object):
+    """
+    youtube_dl progress hook that raises StallError when less than
+    min_speed bytes/s arrived over the last `window` seconds, or
+    DeadlineExceeded when more than `deadline` seconds went by since the
+    watchdog was created. One watchdog is meant for all the attempts of a
+    video: restart() resets the speed window for the next attempt from the
+    .part file and keeps the deadline running.
+    """
+    def __init__(self, min_speed=16 * 1024, window=60, deadline=None, clock=time.time):
+        self.min_speed = min_speed
+        self.window = window
+        self.deadline = deadline
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.attempt_started = self.started
+        self.files_bytes = {}
+        self.samples = deque()
+
+    def restart(self):
+        with self.lock:
+            self.attempt_started = self.clock()
+            self.files_bytes = {}
+            self.samples = deque()
+
+    def hook(self, status):
+        if status.get("status") != "downloading":
+            return
+        filename = status.get("filename")
+        downloaded = status.get("downloaded_bytes") or 0
+        with self.lock:
+            now = self.clock()
+            # bytes resumed from a .part file don't count as throughput
+            baseline = self.files_bytes.setdefault(filename, [downloaded, downloaded])[0]
+            self.files_bytes[filename][1] = max(downloaded, baseline)
+            self.samples.append((now, sum(current - first
+                for first, current in self.files_bytes.values())))
+            while len(self.samples) > 1 and now - self.samples[1][0] >= self.window:
+                self.samples.popleft()
+            if self.deadline is not None and now - self.started > self.deadline:
+                raise DeadlineExceeded("deadline of {}s exceeded".format(self.deadline))
+            oldest, oldest_bytes = self.samples[0]
+            span = now - oldest
+            if now - self.attempt_started >= self.window and span >= self.window:
+                speed = (self.samples[-1][1] - oldest_bytes) / span
+                if speed < self.min_speed:
+                    raise StallError("stalled at {}/s for {:.0f}s".format(
+                        format_bytes(speed), span))
@@ -0,0 +1,208 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from youtube_dl.downloader import external
+from youtube_dl.downloader.http import HttpFD
+
+from utils import if_file_exists, write_file_atomic
+
+
+LOGGER = logging.getLogger()
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+MIN_SEGMENT_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+RETRIES = 3
+# chunks between two saves of the segments state
+STATE_EVERY = 64
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class SegmentedDownload(object):
+    """
+    Download url into filepath over several parallel Range requests. The
+    data goes into a preallocated <filepath>.segpart file and the progress
+    of every segment is kept in <filepath>.segments, so an interrupted
+    download resumes each segment where it stopped. Raises
+    RangeNotSupported if the server does not answer with 206 responses.
+    """
+    def __init__(self, session, url, filepath, headers=None, segments=4,
+            min_segment_size=MIN_SEGMENT_SIZE, progress=None):
+        self.session = session
+        self.url = url
+        self.filepath = filepath
+        self.part_path = filepath + ".segpart"
+        self.state_path = filepath + ".segments"
+        self.headers = headers or {}
+        self.segments = segments
+        self.min_segment_size = min_segment_size
+        self.progress = progress
+        self.lock = threading.Lock()
+        self.state_lock = threading.Lock()
+        self.aborted = threading.Event()
+        self.total = None
+        self.state = None
+
+    def request(self, start, end):
+        headers = dict(self.headers)
+        headers["Range"] = "bytes={}-{}".format(start, end)
+        response = self.session.get(self.url, headers=headers, stream=True, timeout=30)
+        response.raise_for_status()
+        match = CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+        if response.status_code != 206 or match is None or int(match.group(1)) != start:
+            response.close()
+            raise RangeNotSupported(self.url)
+        return response, int(match.group(3))
+
+    def probe(self):
+        response, total = self.request(0, 0)
+        response.close()
+        return total
+
+    def plan(self, total):
+        count = max(1, min(self.segments, total // self.min_segment_size))
+        size = total // count
+        segments = []
+        for i in range(count):
+            start = i * size
+            end = total - 1 if i == count - 1 else start + size - 1
+            segments.append([start, end, 0])
+        return segments
+
+    def load_state(self, total):
+        if if_file_exists(self.state_path) and if_file_exists(self.part_path) and\
+                os.path.getsize(self.part_path) == total:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("total") == total:
+                return state
+        with open(self.part_path, "wb") as f:
+            f.truncate(total)
+        return dict(total=total, segments=self.plan(total))
+
+    def save_state(self):
+        with self.state_lock:
+            with self.lock:
+                content = json.dumps(self.state)
+            write_file_atomic(self.state_path, content, mode="w")
+
+    def downloaded(self):
+        with self.lock:
+            return sum(done for _, _, done in self.state["segments"])
+
+    def fetch_segment(self, segment):
+        try:
+            self.fetch_range(segment)
+        except BaseException:
+            # stop the other segments too, their progress is kept in the state
+            self.aborted.set()
+            raise
+
+    def fetch_range(self, segment):
+        start, end, _ = segment
+        for tries in range(RETRIES + 1):
+            if start + segment[2] > end or self.aborted.is_set():
+                return
+            try:
+                response, _ = self.request(start + segment[2], end)
+                with open(self.part_path, "r+b") as f:
+                    f.seek(start + segment[2])
+                    for i, chunk in enumerate(response.iter_content(CHUNK_SIZE), 1):
+                        if self.aborted.is_set():
+                            break
+                        chunk = chunk[:end + 1 - start - segment[2]]
+                        f.write(chunk)
+                        with self.lock:
+                            segment[2] += len(chunk)
+                        if i % STATE_EVERY == 0:
+                            f.flush()
+                            self.save_state()
+                        if self.progress is not None:
+                            self.progress(self.downloaded(), self.total)
+                response.close()
+                self.save_state()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if tries == RETRIES:
+                    raise
+                LOGGER.info("    + Segment {}-{} retry: {}".format(start, end, e))
+                self.save_state()
+                time.sleep(1)
+
+    def run(self):
+        self.total = self.probe()
+        self.state = self.load_state(self.total)
+        self.save_state()
+        with ThreadPoolExecutor(max_workers=len(self.state["segments"])) as executor:
+            list(executor.map(self.fetch_segment, self.state["segments"]))
+
+        downloaded = self.downloaded()
+        size = os.path.getsize(self.part_path)
+        if downloaded != self.total or size != self.total:
+            raise IOError("Incomplete segmented download: {} of {} bytes ({} on disk)".format(
+                downloaded, self.total, size))
+        os.replace(self.part_path, self.filepath)
+        os.remove(self.state_path)
+        return self.total
+
+    def clean(self):
+        for filepath in (self.part_path, self.state_path):
+            if if_file_exists(filepath):
+                os.remove(filepath)
+
+
+class SegmentedFD(HttpFD):
+    """
+    youtube_dl downloader for plain http(s) formats that uses
+    SegmentedDownload through the 'segments_session' param and falls back
+    to HttpFD when the server ignores Range requests. It is selected with
+    the 'external_downloader': 'segmented' param.
+    """
+    @staticmethod
+    def can_download(info_dict):
+        return info_dict.get("protocol") in ("http", "https")
+
+    def real_download(self, filename, info_dict):
+        started = time.time()
+
+        def progress(downloaded, total):
+            elapsed = time.time() - started
+            self._hook_progress({
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': total,
+                'filename': filename,
+                'elapsed': elapsed,
+                'speed': downloaded / elapsed if elapsed > 0 else None,
+            })
+
+        download = SegmentedDownload(self.params["segments_session"], info_dict["url"],
+            filename, headers=info_dict.get("http_headers"),
+            segments=self.params.get("segments", 4), progress=progress)
+        try:
+            total = download.run()
+        except RangeNotSupported:
+            LOGGER.info("    + Range requests not supported, downloading in one stream")
+            download.clean()
+            return HttpFD.real_download(self, filename, info_dict)
+
+        self._hook_progress({
+            'status': 'finished',
+            'downloaded_bytes': total,
+            'total_bytes': total,
+            'filename': filename,
+            'elapsed': time.time() - started,
+        })
+        return True
+
+
+# youtube_dl looks up external_downloader names in this registry
+external._BY_NAME["segmented"] = SegmentedFD
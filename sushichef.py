@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import atexit
 from bs4 import BeautifulSoup
 import codecs
 from collections import defaultdict, OrderedDict
@@ -28,12 +29,23 @@ from utils import if_dir_exists, get_name_from_url, clone_repo, build_path
 from utils import if_file_exists, get_video_resolution_format, remove_links
 from utils import get_name_from_url_no_ext, get_node_from_channel, get_level_map
 from utils import remove_iframes, get_confirm_token, save_response_content
+from utils import get_youtube_id, get_youtube_url
 import youtube_dl
+from progress import ProgressReporter, StallWatchdog, StallError, DeadlineExceeded
+from chef_logging import setup_logging, stop_logging, log_context
+from assets import Asset, AssetCache
+from profiling import ScrapeProfiler
+from transport import Transport
+import segmented
+from caches import NegativeCache, PageModelCache
+from daemon import ChefDaemon
+from mp4 import FaststartPool, verify_mp4, verify_videos
 
 
 BASE_URL = "http://www.abdullaheid.net/"
 
 DATA_DIR = "chefdata"
+CHEF_DIR = os.path.dirname(os.path.realpath(__file__))
 COPYRIGHT_HOLDER = "Abdullah Eid Educational Network"
 LICENSE = get_license(licenses.SPECIAL_PERMISSIONS, 
         copyright_holder=COPYRIGHT_HOLDER,
@@ -41,18 +53,9 @@ LICENSE = get_license(licenses.SPECIAL_PERMISSIONS,
 AUTHOR = "Abdullah Eid"
 
 LOGGER = logging.getLogger()
-__logging_handler = logging.StreamHandler()
-LOGGER.addHandler(__logging_handler)
-LOGGER.setLevel(logging.INFO)
 
-DOWNLOAD_VIDEOS = True
-
-sess = requests.Session()
-cache = FileCache('.webcache')
-basic_adapter = CacheControlAdapter(cache=cache)
-forever_adapter = CacheControlAdapter(heuristic=CacheForeverHeuristic(), cache=cache)
-sess.mount('http://', basic_adapter)
-sess.mount(BASE_URL, forever_adapter)
+WORKERS = 4
+SOCKET_TIMEOUT = 30
 
 # Run constants
 ################################################################################
@@ -65,84 +68,220 @@ CHANNEL_THUMBNAIL = None                                    # Local path or url
 
 # Additional constants
 ################################################################################
+ASSETS = [
+    Asset("styles.css",
+        "https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css"),
+    Asset("highlight_default.css",
+        "https://raw.githubusercontent.com/richleland/pygments-css/master/default.css",
+        transform=lambda content: content.replace(b".highlight", b".codehilite")),
+    Asset("scripts.js",
+        "https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js"),
+]
+
+
+class RunContext(object):
+    """
+    The options, http transport, caches and output paths of one scrape. It
+    is passed down to PageParser, Section and YouTubeResource instead of
+    module globals, so scrapes with different options can run in the same
+    process. The transport and the caches can be shared between contexts
+    to keep them warm.
+    """
+    def __init__(self, download_videos=True, segments=0, workers=WORKERS,
+            recheck_unavailable=False, min_speed=16 * 1024, stall_window=60,
+            video_deadline=30 * 60, videos_dir=None, cache_dir=None,
+            transport=None, page_cache=None, negative_cache=None,
+            resources=None, progress=None, profiler=None, faststart=None):
+        self.download_videos = download_videos
+        # parallel Range connections per video file, 0 downloads in one stream
+        self.segments = segments
+        self.workers = workers
+        self.recheck_unavailable = recheck_unavailable
+        # a download attempt slower than min_speed bytes/s over stall_window
+        # seconds is restarted, a video whose attempts took longer than
+        # video_deadline seconds in total is given up for this run
+        self.min_speed = min_speed
+        self.stall_window = stall_window
+        self.video_deadline = video_deadline
+        self.videos_dir = videos_dir or os.path.join(DATA_DIR, "abdullah_videos")
+        self.cache_dir = cache_dir or os.path.join(CHEF_DIR, DATA_DIR)
+        if transport is None:
+            transport = Transport(workers=workers * max(1, segments),
+                cache=FileCache('.webcache'), forever_urls=[BASE_URL])
+        self.transport = transport
+        if page_cache is None:
+            page_cache = PageModelCache(os.path.join(self.cache_dir, "pages"))
+        self.page_cache = page_cache
+        if negative_cache is None:
+            negative_cache = NegativeCache(os.path.join(self.cache_dir, "unavailable_videos.json"))
+        self.negative_cache = negative_cache
+        # resources already resolved, keyed by youtube video id
+        self.resources = resources if resources is not None else {}
+        self.progress = progress if progress is not None else ProgressReporter()
+        self.profiler = profiler if profiler is not None else ScrapeProfiler(None, sample_rate=0)
+        # FaststartPool that moves moov to the front of the downloaded videos
+        self.faststart = faststart
+
+    @property
+    def session(self):
+        return self.transport.session
+
+    def watchdog(self):
+        return StallWatchdog(min_speed=self.min_speed, window=self.stall_window,
+            deadline=self.video_deadline)
+
+    def known_failure(self, video_id):
+        if self.recheck_unavailable:
+            return None
+        return self.negative_cache.get(video_id)
+
+    def close(self):
+        # the remuxed files must be in place before the tree is written
+        if self.faststart is not None:
+            self.faststart.close()
+        self.progress.close()
+        self.transport.log_stats()
+        self.negative_cache.report()
+        self.negative_cache.save()
+
 
 class PageParser:
-    def __init__(self, page_url):
+    def __init__(self, page_url, context):
         self.page_url = page_url
-        self.page = self.to_soup()
-
-    def to_soup(self):
-        document = download(self.page_url)
-        if document is not None:
-            return BeautifulSoup(document, 'html.parser') #html5lib
+        self.context = context
+        self.profiler = context.profiler
+        with self.profiler.stage("homepage"):
+            self.sections = self.page_model()
+
+    def page_model(self):
+        """
+        Returns the sections of the page as plain dicts, the model is cached
+        by the hash of the document so an unchanged page is not parsed again.
+        """
+        document = download(self.page_url, self.context.session)
+        if not document:
+            # fails the run so the last good tree is not replaced by an empty one
+            raise IOError("The page {} could not be downloaded".format(self.page_url))
+        if not isinstance(document, bytes):
+            document = document.encode("utf-8")
+        key = hashlib.sha256(document).hexdigest()
+        sections = self.context.page_cache.get(self.page_url, key)
+        if sections is None:
+            sections = self.parse(document)
+            if len(sections) == 0:
+                raise IOError("No sections found in {}".format(self.page_url))
+            self.context.page_cache.set(self.page_url, key, sections)
+        return sections
+
+    def parse(self, document):
+        page = BeautifulSoup(document, 'html.parser') #html5lib
+        section_nodes = page.findAll(lambda tag: tag.name == "div" and tag.findChildren("h2", class_="color-blue"))
+        return [Section.parse(section_node) for section_node in section_nodes]
 
     def get_sections(self, from_i=0, to_i=None):
-        section_nodes = self.page.findAll(lambda tag: tag.name == "div" and tag.findChildren("h2", class_="color-blue"))
-        to_i = len(section_nodes) + 1 if to_i is None else to_i
-        for i, section_node in enumerate(section_nodes, 1):
+        to_i = len(self.sections) + 1 if to_i is None else to_i
+        for i, section in enumerate(self.sections, 1):
             if from_i <= i < to_i:
-                section = Section(section_node)
-                yield section
+                yield Section(section["title"], section["description"], section["links"],
+                    self.context)
 
     def write_videos(self, from_i=0, to_i=None):
-        path = [DATA_DIR] + ["abdullah_videos"]
-        path = build_path(path)
-        for section in self.get_sections(from_i=from_i, to_i=to_i):
+        path = build_path([self.context.videos_dir])
+        sections = list(self.get_sections(from_i=from_i, to_i=to_i))
+        # every total is known up front so the ETA covers the whole run
+        for section in sections:
+            self.context.progress.add_section(section.title, len(section.links_list))
+        for section in sections:
             LOGGER.info("* Section: {}".format(section.title))
-            section.download(download=DOWNLOAD_VIDEOS, base_path=path)
+            with self.profiler.stage(section.title):
+                section.download(download=self.context.download_videos, base_path=path)
             yield section.to_node()
 
 
 class Section:
-    def __init__(self, section_node, lang="ar"):
-        self.html_node = section_node
+    def __init__(self, title, description, links, context, lang="ar"):
+        self.title = title
+        self.description = description
+        self.links_list = links
+        self.context = context
+        self.progress = context.progress
         self.tree_nodes = OrderedDict()
         self.lang = lang
 
-    @property
-    def title(self):
-        return self.html_node.find("h2").text
-
-    @property
-    def description(self):
-        return self.html_node.find("p").text
-
-    def links(self):
-        ol = self.html_node.find(lambda tag: tag.name == "ol" and\
+    @staticmethod
+    def parse(section_node):
+        ol = section_node.find(lambda tag: tag.name == "ol" and\
         tag.findParent("div", class_="list-wrapper clearfix"))
+        links = []
         for li in ol.findAll("li"):
             a = li.find("a")
-            yield a.text, a.attrs.get("href", "")
+            links.append([a.text, a.attrs.get("href", "")])
+        return dict(
+            title=section_node.find("h2").text,
+            description=section_node.find("p").text,
+            links=links)
+
+    def links(self):
+        for name, link in self.links_list:
+            yield name, link
+
+    def resource(self, link, name, download=True, base_path=None):
+        """
+        Returns the YouTubeResource for link, the same video linked in other
+        forms (youtu.be, embed, extra query params) is resolved only once
+        per run through the context resources keyed by video id.
+        """
+        video_id = get_youtube_id(link)
+        resources = self.context.resources
+        with log_context(section=self.title, video_id=video_id):
+            if video_id is not None and video_id in resources:
+                LOGGER.info("    + Already resolved: {}".format(video_id))
+                youtube = copy.copy(resources[video_id])
+                youtube.name = name
+                return youtube
+            youtube = YouTubeResource(link, name=name, lang=self.lang,
+                section_title=self.title, context=self.context)
+            youtube.download(download, base_path)
+            if video_id is not None:
+                resources[video_id] = youtube
+            return youtube
+
+    def video_done(self, link):
+        self.progress.video_done(self.title, get_youtube_id(link) or link)
 
     def download(self, download=True, base_path=None):
+        links = list(self.links())
         if self.is_curriculum():
             curriculum = MathCurriculum()
             curriculum_nodes = curriculum.nodes()
             index_map = curriculum.index_map()
-            for i, (name, link) in enumerate(self.links(), 1):
+            for i, (name, link) in enumerate(links, 1):
                 name = "{}. {}".format(i, name)
                 LOGGER.info("  Title: {}".format(name))
                 topic_name = index_map[i]
-                youtube = YouTubeResource(link, name=name, lang=self.lang, 
-                    section_title=self.title)
-                youtube.download(download, base_path)
+                youtube = self.resource(link, name, download=download,
+                    base_path=base_path)
                 node = youtube.to_node()
+                self.video_done(link)
                 if node is not None:
                     curriculum_nodes[topic_name]["children"].append(node)
             self.tree_nodes = curriculum_nodes
         else:
             i = 1
-            for name, link in self.links():
+            for name, link in links:
+                key = get_youtube_id(link) or link
+                if key in self.tree_nodes:
+                    self.video_done(link)
+                    continue
                 name = "{}. {}".format(i, name)
                 LOGGER.info("  Title: {}".format(name))
-                youtube = YouTubeResource(link, name=name, lang=self.lang, 
-                    section_title=self.title)
-                youtube.download(download, base_path)
+                youtube = self.resource(link, name, download=download,
+                    base_path=base_path)
                 node = youtube.to_node()
+                self.video_done(link)
                 if node is not None:
-                    if node["source_id"] not in self.tree_nodes:
-                        self.tree_nodes[node["source_id"]] = node
-                        i += 1
+                    self.tree_nodes[key] = node
+                    i += 1
 
     def digital_literacy_node(self):
         return dict(
@@ -220,7 +359,7 @@ class MathCurriculum:
 
 class YouTubeResource(object):
     def __init__(self, source_id, name=None, type_name="Youtube", lang="ar", 
-            embeded=False, section_title=None):
+            embeded=False, section_title=None, context=None):
         LOGGER.info("    + Resource Type: {}".format(type_name))
         LOGGER.info("    - URL: {}".format(source_id))
         self.filename = None
@@ -228,14 +367,23 @@ class YouTubeResource(object):
         self.filepath = None
         self.name = name
         self.section_title = section_title
+        self.context = context if context is not None else RunContext()
         if embeded is True:
             self.source_id = YouTubeResource.transform_embed(source_id)
         else:
             self.source_id = self.clean_url(source_id)
+        self.video_id = get_youtube_id(self.source_id)
+        self.info = None
         self.file_format = file_formats.MP4
         self.lang = lang
         self.is_valid = False
 
+    @property
+    def url(self):
+        if self.video_id is not None:
+            return get_youtube_url(self.video_id)
+        return self.source_id
+
     def clean_url(self, url):
         if url[-1] == "/":
             url = url[:-1]
@@ -253,7 +401,12 @@ class YouTubeResource(object):
         url = "".join(url.split("?")[:1])
         return url.replace("embed/", "watch?v=").strip()
 
-    def get_video_info(self, download_to=None, subtitles=True):
+    def get_video_info(self, download_to=None, subtitles=True, watchdog=None):
+        known_failure = self.context.known_failure(self.video_id)
+        if known_failure is not None:
+            LOGGER.info("    + Skipped, the video is {}".format(known_failure["failure"]))
+            return
+
         ydl_options = {
                 'writesubtitles': subtitles,
                 'allsubtitles': subtitles,
@@ -263,24 +416,38 @@ class YouTubeResource(object):
                 'quiet': True,
                 'format': "bestvideo[height<={maxheight}][ext=mp4]+bestaudio[ext=m4a]/best[height<={maxheight}][ext=mp4]".format(maxheight='480'),
                 'outtmpl': '{}/%(id)s'.format(download_to),
-                'noplaylist': False
+                'noplaylist': False,
+                'socket_timeout': SOCKET_TIMEOUT,
+                'retries': 3
             }
-
-        with youtube_dl.YoutubeDL(ydl_options) as ydl:
-            try:
-                ydl.add_default_info_extractors()
-                info = ydl.extract_info(self.source_id, download=(download_to is not None))
-                return info
-            except(youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
-                    youtube_dl.utils.ExtractorError) as e:
-                LOGGER.info('An error occured ' + str(e))
-                LOGGER.info(self.source_id)
-            except KeyError as e:
-                LOGGER.info(str(e))
+        transport = self.context.transport
+        if self.context.segments > 0 and download_to is not None:
+            ydl_options['external_downloader'] = 'segmented'
+            ydl_options['segments'] = self.context.segments
+            ydl_options['segments_session'] = transport.media_session
+        if download_to is not None:
+            if watchdog is None:
+                watchdog = self.context.watchdog()
+            ydl_options['progress_hooks'] = [
+                self.context.progress.hook(self.section_title, self.video_id),
+                watchdog.hook]
+
+        ydl = transport.youtube_dl(ydl_options)
+        try:
+            info = ydl.extract_info(self.url, download=(download_to is not None))
+            self.context.negative_cache.remove(self.video_id)
+            return info
+        except(youtube_dl.utils.DownloadError, youtube_dl.utils.ContentTooShortError,
+                youtube_dl.utils.ExtractorError) as e:
+            LOGGER.info('An error occured ' + str(e))
+            LOGGER.info(self.source_id)
+            self.context.negative_cache.add(self.video_id, e)
+        except KeyError as e:
+            LOGGER.info(str(e))
 
     def subtitles_dict(self):
         subs = []
-        video_info = self.get_video_info()
+        video_info = self.info if self.info is not None else self.get_video_info()
         if video_info is not None:
             video_id = video_info["id"]
             if 'subtitles' in video_info:
@@ -293,21 +460,40 @@ class YouTubeResource(object):
     #sometimes raises connection error
     #for that I choose pafy for downloading
     def download(self, download=True, base_path=None):
-        if not "watch?" in self.source_id or "/user/" in self.source_id or\
-            download is False:
+        if self.video_id is None or download is False:
             return
 
         download_to = build_path([base_path, 'videos', self.section_title])
+        # the deadline covers every attempt of the video
+        watchdog = self.context.watchdog()
         for i in range(4):
+            watchdog.restart()
             try:
-                info = self.get_video_info(download_to=download_to, subtitles=False)
+                info = self.get_video_info(download_to=download_to, subtitles=False,
+                    watchdog=watchdog)
                 if info is not None:
+                    self.info = info
                     LOGGER.info("    + Video resolution: {}x{}".format(info.get("width", ""), info.get("height", "")))
                     self.filepath = os.path.join(download_to, "{}.mp4".format(info["id"]))
                     self.filename = info["title"]
-                    if self.filepath is not None and os.stat(self.filepath).st_size == 0:
-                        LOGGER.info("    + Empty file")
+                    reason = verify_mp4(self.filepath)
+                    if reason is not None:
+                        LOGGER.info("    + Broken file: {}".format(reason))
+                        if if_file_exists(self.filepath):
+                            os.remove(self.filepath)
                         self.filepath = None
+                        continue
+                    if self.context.faststart is not None:
+                        self.context.faststart.submit(self.filepath)
+            except StallError as e:
+                # continuedl resumes from the .part file in the next attempt
+                progress = self.context.progress
+                progress.incident(e.kind, self.section_title, self.video_id, str(e))
+                if isinstance(e, DeadlineExceeded):
+                    return
+                if i < 3:
+                    progress.incident("restart", self.section_title, self.video_id,
+                        "attempt {}".format(i + 2))
             except (ValueError, IOError, OSError, URLError, ConnectionResetError) as e:
                 LOGGER.info(e)
                 LOGGER.info("Download retry")
@@ -338,11 +524,11 @@ class YouTubeResource(object):
             return node
 
 
-def download(source_id):
+def download(source_id, session):
     tries = 0
     while tries < 4:
         try:
-            document = downloader.read(source_id, loadjs=False, session=sess)
+            document = downloader.read(source_id, loadjs=False, session=session)
         except requests.exceptions.HTTPError as e:
             LOGGER.info("Error: {}".format(e))
         except requests.exceptions.ConnectionError:
@@ -358,6 +544,58 @@ def download(source_id):
     return False
 
 
+def section_range(only_section):
+    """Returns (from_i, to_i) for an --only-section value like 3, 2:5, :4 or 6:"""
+    if only_section is None:
+        return 0, None
+    index = only_section.split(":")
+    if len(index) == 2:
+        if index[0] == "":
+            return 0, int(index[1])
+        elif index[1] == "":
+            return int(index[0]), None
+        else:
+            from_i, to_i = map(int, index)
+            return from_i, to_i
+    from_i = int(index[0])
+    return from_i, from_i + 1
+
+
+def scrape_channel(context, from_i=0, to_i=None, lang="ar"):
+    """
+    Scrape the channel with the given RunContext and return the json tree,
+    it does not touch any module state so it can run concurrently.
+    """
+    channel_tree = dict(
+            source_domain=BASE_URL,
+            source_id=CHANNEL_SOURCE_ID,
+            title=CHANNEL_NAME,
+            description="""شبكة عبد الله عيد هي شبكة سعودية تزود المهتمين من المتعلمين الكبار وفي المرحلة الثانوية المهتمين بالبرمجة بمجموعة من الدورات المختلفة في استخدام أنظمة جافا و HTML و الأندرويد وتطبيقات الأندرويد و XMinds و جافا سكربت دوم وغيرها. تتلاءم الكثير من هذه الدروس مع مناهج الدراسات العليا لكثير من الجامعات العربية كما أنّ البعض منها ملائم للمرحلة الثانوية. وهناك في النهاية مجموعة من الدروس في علم الجبر لمتعلمي المرحلة"""
+[:400], #400 UPPER LIMIT characters allowed 
+            thumbnail="abdullahed_logo.jpg",
+            author=AUTHOR,
+            language=lang,
+            children=[],
+            license=LICENSE,
+        )
+
+    try:
+        if context.download_videos and if_dir_exists(context.videos_dir):
+            # broken files are removed here so youtube_dl fetches them again
+            broken = set(os.path.abspath(filepath)
+                for filepath, _ in verify_videos(context.videos_dir))
+            for video_id, resource in list(context.resources.items()):
+                if resource.filepath is not None and\
+                        os.path.abspath(resource.filepath) in broken:
+                    del context.resources[video_id]
+        page_parser = PageParser(BASE_URL, context)
+        for section_node in page_parser.write_videos(from_i=from_i, to_i=to_i):
+            channel_tree["children"].append(section_node)
+    finally:
+        context.close()
+    return channel_tree
+
+
 # The chef subclass
 ################################################################################
 class AbdullaheidChef(JsonTreeChef):
@@ -370,78 +608,99 @@ class AbdullaheidChef(JsonTreeChef):
         build_path([AbdullaheidChef.TREES_DATA_DIR])
         self.scrape_stage = os.path.join(AbdullaheidChef.TREES_DATA_DIR, 
                                 AbdullaheidChef.SCRAPING_STAGE_OUTPUT_TPL)
+        # kept between daemon cycles so every scrape starts warm
+        self.transport = None
+        self.page_cache = None
+        self.negative_cache = None
+        self.resources = {}
         super(AbdullaheidChef, self).__init__()
 
-    def download_css_js(self):
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/css/styles.css")
-        with open("chefdata/styles.css", "wb") as f:
-            f.write(r.content)
+    def get_transport(self, workers=None):
+        """The shared transport, resized only when workers is given."""
+        if self.transport is None:
+            self.transport = Transport(workers=workers or WORKERS,
+                cache=FileCache('.webcache'), forever_urls=[BASE_URL])
+        elif workers is not None:
+            self.transport.resize(workers)
+        return self.transport
 
-        r = requests.get("https://raw.githubusercontent.com/richleland/pygments-css/master/default.css")
-        with open("chefdata/highlight_default.css", "w") as f:
-            f.write(r.content.decode("utf-8").replace(".highlight", ".codehilite"))
-
-        r = requests.get("https://raw.githubusercontent.com/learningequality/html-app-starter/master/js/scripts.js")
-        with open("chefdata/scripts.js", "wb") as f:
-            f.write(r.content)
+    def download_css_js(self, offline=False):
+        assets = AssetCache(os.path.join(CHEF_DIR, DATA_DIR), ASSETS)
+        return assets.fetch(self.get_transport().session, offline=offline, workers=WORKERS)
 
     def pre_run(self, args, options):
-        css = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chefdata/styles.css")
-        js = os.path.join(os.path.dirname(os.path.realpath(__file__)), "chefdata/scripts.js")
-        if not if_file_exists(css) or not if_file_exists(js):
-            LOGGER.info("Downloading styles")
-            self.download_css_js()
+        offline_assets = options.get('--offline-assets', "0")
+        segments = int(options.get('--segments', "0"))
+        # sized before the first request so the pools are not rebuilt
+        self.get_transport(WORKERS * max(1, segments))
+        self.download_css_js(offline=int(offline_assets) == 1)
         self.write_tree_to_json(self.scrape(args, options))
 
-    def scrape(self, args, options):
-        LANG = 'ar'
-        only_section = options.get('--only-section', None)
+    def run(self, args, options):
+        log_file = options.get('--log-file', None)
+        # --quiet is ricecooker's own flag, it can't take a value
+        quiet = args.get("quiet") or int(options.get('--quiet-console', "0")) == 1
+        # the logging is process wide, it is set once here and not per scrape
+        setup_logging(LOGGER, log_file=log_file, quiet=quiet)
+        atexit.register(stop_logging, LOGGER)
+        daemon = options.get('--daemon', "0")
+        if int(daemon) == 0:
+            return super(AbdullaheidChef, self).run(args, options)
+
+        interval = options.get('--interval', str(6 * 60 * 60))
+        port = options.get('--daemon-port', "8765")
+        chef_daemon = ChefDaemon(lambda: self.pre_run(args, options),
+            interval=float(interval), port=int(port))
+        chef_daemon.serve()
+
+    def run_context(self, options):
         download_video = options.get('--download-video', "1")
+        progress_events = options.get('--progress-events', None)
+        profile = options.get('--profile', "0")
+        segments = int(options.get('--segments', "0"))
+        recheck_unavailable = options.get('--recheck-unavailable', "0")
+        min_speed = options.get('--min-speed', str(16 * 1024))
+        stall_window = options.get('--stall-window', "60")
+        video_deadline = options.get('--video-deadline', str(30 * 60))
+        faststart = options.get('--faststart', None)
+
+        cache_dir = os.path.join(CHEF_DIR, DATA_DIR)
+        if self.page_cache is None:
+            self.page_cache = PageModelCache(os.path.join(cache_dir, "pages"))
+        if self.negative_cache is None:
+            self.negative_cache = NegativeCache(os.path.join(cache_dir, "unavailable_videos.json"))
+        # resources that failed to download or whose file is gone are tried
+        # again in the next cycle
+        self.resources = dict((video_id, resource) for video_id, resource in self.resources.items()
+            if resource.filepath is not None and if_file_exists(resource.filepath))
+        return RunContext(
+            download_videos=int(download_video) != 0,
+            segments=segments,
+            recheck_unavailable=int(recheck_unavailable) == 1,
+            min_speed=float(min_speed),
+            stall_window=float(stall_window),
+            video_deadline=float(video_deadline) if float(video_deadline) > 0 else None,
+            cache_dir=cache_dir,
+            transport=self.get_transport(WORKERS * max(1, segments)),
+            page_cache=self.page_cache,
+            negative_cache=self.negative_cache,
+            resources=self.resources,
+            faststart=FaststartPool(os.path.join(cache_dir, "faststart.json"), method=faststart)
+                if faststart is not None else None,
+            progress=ProgressReporter(events_path=progress_events),
+            profiler=ScrapeProfiler(os.path.join(cache_dir, "profiles"),
+                sample_rate=float(profile)))
 
-        if int(download_video) == 0:
-            global DOWNLOAD_VIDEOS
-            DOWNLOAD_VIDEOS = False
-
-        if only_section is None:
-            from_i = 0
-            to_i = None
-        else:
-            index = only_section.split(":")
-            if len(index) == 2:
-                if index[0] == "":
-                    from_i = 0
-                    to_i = int(index[1])
-                elif index[1] == "":
-                    from_i = int(index[0])
-                    to_i = None
-                else:
-                    index = map(int, index)
-                    from_i, to_i = index
-            elif len(index) == 1:
-                from_i = int(index[0])
-                to_i = from_i + 1
-
-        global channel_tree
-        channel_tree = dict(
-                source_domain=AbdullaheidChef.HOSTNAME,
-                source_id=CHANNEL_SOURCE_ID,
-                title=CHANNEL_NAME,
-                description="""شبكة عبد الله عيد هي شبكة سعودية تزود المهتمين من المتعلمين الكبار وفي المرحلة الثانوية المهتمين بالبرمجة بمجموعة من الدورات المختلفة في استخدام أنظمة جافا و HTML و الأندرويد وتطبيقات الأندرويد و XMinds و جافا سكربت دوم وغيرها. تتلاءم الكثير من هذه الدروس مع مناهج الدراسات العليا لكثير من الجامعات العربية كما أنّ البعض منها ملائم للمرحلة الثانوية. وهناك في النهاية مجموعة من الدروس في علم الجبر لمتعلمي المرحلة"""
-[:400], #400 UPPER LIMIT characters allowed 
-                thumbnail="abdullahed_logo.jpg",
-                author=AUTHOR,
-                language=LANG,
-                children=[],
-                license=LICENSE,
-            )
-
-        page_parser = PageParser(BASE_URL)
-        for section_node in page_parser.write_videos(from_i=from_i, to_i=to_i):
-            channel_tree["children"].append(section_node)
-        return channel_tree
+    def scrape(self, args, options):
+        only_section = options.get('--only-section', None)
+        from_i, to_i = section_range(only_section)
+        return scrape_channel(self.run_context(options), from_i=from_i, to_i=to_i)
 
     def write_tree_to_json(self, channel_tree):
-        write_tree_to_json_tree(self.scrape_stage, channel_tree)
+        # written aside and renamed so readers never see a partial tree
+        tmp_stage = "{}.tmp".format(self.scrape_stage)
+        write_tree_to_json_tree(tmp_stage, channel_tree)
+        os.replace(tmp_stage, self.scrape_stage)
 
 
 # CLI
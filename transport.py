@@ -0,0 +1,161 @@
+import http.client
+import logging
+import threading
+from urllib.error import URLError
+import urllib.request
+import urllib.response
+
+import requests
+from requests.adapters import HTTPAdapter
+from ricecooker.utils.caching import CacheForeverHeuristic, CacheControlAdapter
+import youtube_dl
+
+
+LOGGER = logging.getLogger()
+
+
+class Transport(object):
+    """
+    One connection pool shared by the page fetches (cached adapters), the
+    asset fetches and the youtube_dl instances (plain adapter, through
+    PooledHandler), sized after the number of workers so keep-alive and
+    TLS sessions are reused across videos.
+    """
+    def __init__(self, workers=4, cache=None, forever_urls=None):
+        self.workers = workers
+        self.local = threading.local()
+        # requests and connections of the pools dropped by resize
+        self.retired = (0, 0)
+        pool = dict(pool_connections=max(10, workers), pool_maxsize=max(1, workers))
+        self.adapter = HTTPAdapter(**pool)
+        self.adapters = [self.adapter]
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        # no http cache for the video streams
+        self.media_session = requests.Session()
+        self.media_session.mount('http://', self.adapter)
+        self.media_session.mount('https://', self.adapter)
+        if cache is not None:
+            basic_adapter = CacheControlAdapter(cache=cache, **pool)
+            self.session.mount('http://', basic_adapter)
+            self.adapters.append(basic_adapter)
+            for url in forever_urls or []:
+                forever_adapter = CacheControlAdapter(heuristic=CacheForeverHeuristic(),
+                    cache=cache, **pool)
+                self.session.mount(url, forever_adapter)
+                self.adapters.append(forever_adapter)
+        else:
+            self.session.mount('http://', self.adapter)
+
+    def resize(self, workers):
+        """
+        Rebuild the pools for a new number of concurrent connections, the
+        sockets of the old pools are closed and their counters kept.
+        """
+        if workers == self.workers:
+            return
+        self.workers = workers
+        self.retired = self.stats()
+        for adapter in self.adapters:
+            adapter.poolmanager.clear()
+            adapter.init_poolmanager(max(10, workers), max(1, workers))
+
+    def install(self, ydl):
+        """Route the http(s) requests of a YoutubeDL instance through the pool."""
+        ydl._opener.add_handler(PooledHandler(self.adapter))
+        return ydl
+
+    def youtube_dl(self, options):
+        """
+        Returns a warm YoutubeDL installed on the pool, one instance per
+        thread and set of options. The progress_hooks option is not part of
+        the key, the hooks are replaced on every call.
+        """
+        options = dict(options)
+        hooks = options.pop('progress_hooks', [])
+        key = repr(sorted((name, repr(value)) for name, value in options.items()))
+        if not hasattr(self.local, "youtube_dl"):
+            self.local.youtube_dl = {}
+        ydl = self.local.youtube_dl.get(key)
+        if ydl is None:
+            ydl = self.install(youtube_dl.YoutubeDL(options))
+            self.local.youtube_dl[key] = ydl
+        ydl._progress_hooks = list(hooks)
+        return ydl
+
+    def stats(self):
+        """Returns the number of requests and of opened connections."""
+        requests_count, connections = self.retired
+        for adapter in self.adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is not None:
+                    requests_count += pool.num_requests
+                    connections += pool.num_connections
+        return requests_count, connections
+
+    def log_stats(self):
+        requests_count, connections = self.stats()
+        reused = requests_count - connections
+        LOGGER.info("HTTP requests: {}, connections opened: {}, reused: {} ({:.0%})".format(
+            requests_count, connections, reused,
+            float(reused) / requests_count if requests_count > 0 else 0))
+
+
+class PooledHandler(urllib.request.BaseHandler):
+    """
+    urllib handler that sends the request through a requests adapter, runs
+    before the youtube_dl http(s) handlers and leaves redirects, cookies,
+    errors and content decoding to the rest of the youtube_dl opener.
+    """
+    handler_order = 400
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+
+    def http_open(self, req):
+        if req.has_proxy() or "Ytdl-socks-proxy" in req.headers:
+            return None
+        timeout = req.timeout if isinstance(req.timeout, (int, float)) else None
+        request = requests.Request(req.get_method(), req.full_url,
+            headers=dict(req.header_items()), data=req.data).prepare()
+        try:
+            response = self.adapter.send(request, stream=True, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            raise URLError(e)
+
+        headers = http.client.HTTPMessage()
+        for key, value in response.raw.headers.items():
+            headers[key] = value
+        resp = urllib.response.addinfourl(PooledBody(response.raw, request.method),
+            headers, req.full_url, response.status_code)
+        resp.msg = response.reason
+        return resp
+
+    https_open = http_open
+
+
+class PooledBody(object):
+    """
+    File object over a urllib3 response for addinfourl. Closing it hands
+    the connection back to the pool when the body has been read (always
+    for HEAD), urllib3 would close the socket otherwise.
+    """
+    def __init__(self, raw, method):
+        self.raw = raw
+        self.method = method
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def close(self):
+        if self.method == "HEAD" or self.raw.length_remaining == 0:
+            # reads the empty rest so http.client marks the response done
+            self.raw.drain_conn()
+            self.raw.release_conn()
+        else:
+            self.raw.close()
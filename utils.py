@@ -1,7 +1,11 @@
 from git import Repo
+import hashlib
 import ntpath
 import os
 from pathlib import Path
+import re
+import tempfile
+from urllib.parse import urlparse, parse_qs
 
 
 def if_dir_exists(filepath):
@@ -60,7 +64,7 @@ def clone_repo(git_url, repo_dir):
 def build_path(levels):
     path = os.path.join(*levels)
     if not if_dir_exists(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
     return path
 
 
@@ -124,3 +128,67 @@ def save_response_content(response, destination):
             if chunk:
                 f.write(chunk)
                 f.flush()
+
+
+YOUTUBE_HOSTS = set(["youtube.com", "www.youtube.com", "m.youtube.com",
+    "music.youtube.com", "youtube-nocookie.com", "www.youtube-nocookie.com"])
+YOUTUBE_ID_RE = re.compile(r"^[0-9A-Za-z_-]{11}$")
+
+
+def get_youtube_id(url, allow_bare_id=False):
+    """
+    Return the canonical 11 chars video id for any youtube link form
+    (watch?v=, youtu.be/, embed/, v/, shorts/, live/) or None if the url
+    is not a single video (channels, users, playlists or other sites).
+    A bare video id is only accepted with allow_bare_id, otherwise relative
+    hrefs that happen to be 11 chars long would be taken for videos.
+    """
+    if url is None:
+        return None
+    url = url.strip()
+    if allow_bare_id and YOUTUBE_ID_RE.match(url):
+        return url
+    if "://" not in url:
+        url = "https://" + url.lstrip("/")
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    path = [part for part in parsed.path.split("/") if part]
+    video_id = None
+    if host in ("youtu.be", "www.youtu.be"):
+        video_id = path[0] if len(path) > 0 else None
+    elif host in YOUTUBE_HOSTS:
+        if len(path) == 1 and path[0] == "watch":
+            video_id = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(path) >= 2 and path[0] in ("embed", "v", "e", "shorts", "live"):
+            video_id = path[1]
+    if video_id is not None and YOUTUBE_ID_RE.match(video_id):
+        return video_id
+    return None
+
+
+def get_youtube_url(video_id):
+    return "https://www.youtube.com/watch?v={}".format(video_id)
+
+
+def write_file_atomic(filepath, content, mode="wb"):
+    """Write content to a temp file in the same dir and rename it over filepath."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)),
+        prefix=os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if if_file_exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_sha256(filepath, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()